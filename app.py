@@ -1 +1,280 @@
+import json
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
 
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+PATTERNS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "patterns.json")
+RELOAD_INTERVAL = 5.0
+
+log = logging.getLogger(__name__)
+
+_PRIORITY = {"block": 0, "mask": 1, "generalize": 2}
+
+_Compiled = namedtuple("_Compiled", "block mask_re mask_table mask_solo")
+
+
+def _compile_re2(pattern):
+    """Return an RE2 regex, or None when google-re2 is missing or rejects the pattern."""
+    if re2 is None:
+        return None
+    try:
+        return re2.compile(pattern)
+    except re2.error:
+        return None
+
+
+# Rules that only work as a standalone regex: backreferences, conditional group
+# references, global inline flags, and named groups would break or rebind
+# inside the fused alternation.
+_UNFUSABLE_RE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(|\(\?[aiLmsux]+\)")
+
+
+def _check(p):
+    """Compile one rule with stdlib re, raising ValueError that names the rule."""
+    try:
+        rx = re.compile(p["regex"], re.ASCII)
+    except (re.error, ValueError) as e:
+        raise ValueError(f"pattern {p['name']!r}: {e}") from None
+    if rx.fullmatch("") is not None:
+        raise ValueError(f"pattern {p['name']!r}: matches the empty string")
+    return rx
+
+
+def _compile(p):
+    """Compile one rule with RE2 when possible, else stdlib re with a warning.
+
+    Returns (regex, fusable_engine): whether the rule may join a union compiled
+    with the engine in use.
+
+    RE2 matches in linear time. The stdlib fallback uses re.ASCII so \\d, \\w,
+    \\s and \\b stay ASCII-only as in RE2.
+    """
+    rx = _check(p)
+    fast = _compile_re2(p["regex"])
+    if fast is not None:
+        return fast, True
+    if re2 is not None:
+        log.warning("pattern %r is not RE2-compatible; matching it with backtracking re", p["name"])
+    return rx, re2 is None
+
+
+def _union(patterns):
+    """Fuse patterns into one alternation; return (regex, {group: (rank, rule)}, solo).
+
+    Earlier alternatives win at the same position. Rules that cannot be fused,
+    or that RE2 rejects, are compiled on their own and returned in solo as
+    (rank, regex, rule), so one such rule never drags the union onto backtracking re.
+    """
+    fused, solo = {}, []
+    for rank, p in enumerate(patterns):
+        rx, engine_ok = _compile(p)
+        if not engine_ok or _check(p).groupindex or _UNFUSABLE_RE.search(p["regex"]):
+            solo.append((rank, rx, p))
+        else:
+            fused[f"g{rank}"] = (rank, p)
+    if not fused:
+        return None, fused, solo
+    union = "|".join(f"(?P<{name}>{p['regex']})" for name, (_, p) in fused.items())
+    rx = _compile_re2(union)
+    if rx is None:
+        if re2 is not None:
+            log.warning("RE2 rejected the fused pattern union; matching it with backtracking re")
+        rx = re.compile(union, re.ASCII)
+    return rx, fused, solo
+
+
+def _matches(rx, table, solo, text):
+    """Yield non-overlapping (start, end, rule) hits, leftmost first, rank breaking ties.
+
+    Every regex keeps its own next hit, searched again from the end of each
+    accepted hit, so text a discarded overlapping hit covered is still scanned.
+    """
+    searchers = [(rx, None)] if rx is not None else []
+    searchers += [(srx, (rank, p)) for rank, srx, p in solo]
+
+    def _next(srx, fixed, pos):
+        while pos <= len(text):
+            m = srx.search(text, pos)
+            if m is None:
+                return None
+            if m.end() > m.start():
+                rank, p = fixed or table[m.lastgroup]
+                return m.start(), rank, m.end(), p
+            pos = m.start() + 1
+        return None
+
+    heads = [_next(srx, fixed, 0) for srx, fixed in searchers]
+    while True:
+        live = [h for h in heads if h is not None]
+        if not live:
+            return
+        start, _, end, p = min(live, key=lambda h: h[:2])
+        yield start, end, p
+        heads = [
+            h if h is None or h[0] >= end else _next(srx, fixed, end)
+            for h, (srx, fixed) in zip(heads, searchers)
+        ]
+
+
+def _validate(data):
+    """Return the sensitive_patterns list, or raise ValueError describing the bad entry."""
+    patterns = data.get("sensitive_patterns") if isinstance(data, dict) else None
+    if not isinstance(patterns, list):
+        raise ValueError("sensitive_patterns must be a list")
+    for i, p in enumerate(patterns):
+        if not isinstance(p, dict):
+            raise ValueError(f"pattern #{i} must be an object")
+        for key in ("name", "regex", "action"):
+            if not isinstance(p.get(key), str):
+                raise ValueError(f"pattern #{i}: {key!r} must be a string")
+        if p["action"] not in _PRIORITY:
+            raise ValueError(f"pattern {p['name']!r}: unknown action {p['action']!r}")
+        if not isinstance(p.get("replacement", ""), str):
+            raise ValueError(f"pattern {p['name']!r}: 'replacement' must be a string")
+    return patterns
+
+
+class PatternSet:
+    """Compiled view of patterns.json, swapped atomically when the file changes."""
+
+    def __init__(self, path=PATTERNS_PATH, interval=RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.stamp = self._stat()
+        self.current = self._compile_all()
+        self._last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _compile_all(self):
+        with open(self.path, encoding="utf-8") as f:
+            patterns = _validate(json.load(f))
+        ordered = sorted(patterns, key=lambda x: _PRIORITY[x["action"]])
+        # Block rules only need one hit each, so each is searched on its own;
+        # a union would hide a rule shadowed by an earlier alternative.
+        block = []
+        for p in ordered:
+            if p["action"] == "block":
+                block.append((_compile(p)[0], p))
+        mask = _union([p for p in ordered if p["action"] != "block"])
+        return _Compiled(block, *mask)
+
+    def _stat(self):
+        # Size as well as mtime: on coarse-mtime filesystems a partial write and
+        # the full write that follows it can share a timestamp.
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def _warn_once(self, e):
+        if str(e) != self._last_error:
+            log.warning("not reloading %s: %s", self.path, e)
+            self._last_error = str(e)
+
+    def reload_if_changed(self):
+        try:
+            stamp = self._stat()
+        except OSError as e:
+            self._warn_once(e)
+            return False
+        if stamp == self.stamp:
+            return False
+        try:
+            compiled = self._compile_all()
+        except (OSError, ValueError) as e:
+            # Keep serving the last good set and retry on the next tick; only
+            # the repeated warning is suppressed.
+            self._warn_once(e)
+            return False
+        self.stamp = stamp
+        self.current = compiled
+        self._last_error = None
+        return True
+
+    def _watch(self, stop):
+        # stop is this thread's own Event; start_watching may install a new
+        # one for a later thread while this one is still finishing a reload.
+        while not stop.wait(self.interval):
+            try:
+                self.reload_if_changed()
+            except Exception:
+                log.exception("pattern reload failed")
+
+    def start_watching(self):
+        """Start the background mtime watcher; no-op if it is already running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._watch, args=(self._stop,), name="pattern-watcher", daemon=True
+            )
+            self._thread.start()
+
+    def stop_watching(self, timeout=None):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stop.set()
+        if thread is not None:
+            thread.join(timeout)
+
+
+PATTERN_SET = PatternSet()
+
+
+def apply_patterns(text):
+    """Apply sensitive patterns to text; return (sanitized_text, findings)."""
+    # Trailing newlines are matched around, not through: stdlib re's $ also
+    # matches before a final newline while RE2's does not, and with no newline
+    # at the end both engines agree. Spans are unaffected.
+    body = text.rstrip("\n")
+    masked, findings = _apply(PATTERN_SET.current, body)
+    return masked + text[len(body):], findings
+
+
+def _apply(ps, text):
+    findings = []
+    for rx, p in ps.block:
+        m = rx.search(text)
+        if m is not None and m.end() > m.start():
+            findings.append({"name": p["name"], "action": "block", "span": m.span()})
+    if ps.mask_re is None and not ps.mask_solo:
+        return text, findings
+
+    if not ps.mask_solo:
+        def _dispatch(m):
+            if m.end() == m.start():
+                # Rules that only match empty (lookarounds, \b) mask nothing.
+                return ""
+            _, p = ps.mask_table[m.lastgroup]
+            findings.append({"name": p["name"], "action": p["action"], "span": m.span()})
+            return p.get("replacement", "")
+
+        return ps.mask_re.sub(_dispatch, text), findings
+
+    # Standalone rules present: merge the per-regex hits in one left-to-right walk.
+    parts, pos = [], 0
+    for start, end, p in _matches(ps.mask_re, ps.mask_table, ps.mask_solo, text):
+        parts.append(text[pos:start])
+        parts.append(p.get("replacement", ""))
+        findings.append({"name": p["name"], "action": p["action"], "span": (start, end)})
+        pos = end
+    parts.append(text[pos:])
+    return "".join(parts), findings
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig()
+    PATTERN_SET.start_watching()
+    for line in sys.stdin:
+        sys.stdout.write(apply_patterns(line)[0])
+        sys.stdout.flush()
@@ -0,0 +1,261 @@
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import pytest
+
+import app
+
+
+def _write(path, data, mtime):
+    Path(path).write_text(data if isinstance(data, str) else json.dumps(data), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def _rule(name, regex, action="mask", replacement="[X]"):
+    return {"name": name, "regex": regex, "action": action, "replacement": replacement}
+
+
+@pytest.fixture
+def pattern_file(tmp_path, monkeypatch):
+    """Point app at a temp patterns.json; returns a function that (re)loads it."""
+    path = tmp_path / "patterns.json"
+
+    def load(rules, mtime=1_000_000):
+        _write(path, {"sensitive_patterns": rules}, mtime)
+        ps = app.PatternSet(str(path))
+        monkeypatch.setattr(app, "PATTERN_SET", ps)
+        return ps
+
+    return load
+
+
+def test_shipped_rules_mask_with_spans_into_original():
+    text = "번호 010-1234-5678, 주민 900101-1234567"
+    masked, findings = app.apply_patterns(text)
+    assert masked == "번호 개인정보, 주민 개인정보"
+    assert [f["name"] for f in findings] == ["전화번호", "주민등록번호"]
+    for f in findings:
+        start, end = f["span"]
+        assert re.fullmatch(r"[\d-]+", text[start:end])
+
+
+def test_block_rules_are_reported_not_rewritten(pattern_file):
+    pattern_file([_rule("secret", r"TOPSECRET", action="block"), _rule("digits", r"\d{4}")])
+    masked, findings = app.apply_patterns("TOPSECRET 1234")
+    assert masked == "TOPSECRET [X]"
+    assert findings == [
+        {"name": "secret", "action": "block", "span": (0, 9)},
+        {"name": "digits", "action": "mask", "span": (10, 14)},
+    ]
+
+
+def test_each_block_rule_is_reported_once(pattern_file):
+    pattern_file([_rule("s1", r"secret", action="block"), _rule("s2", r"secret\d+", action="block")])
+    _, findings = app.apply_patterns("secret123 secret secret")
+    assert findings == [
+        {"name": "s1", "action": "block", "span": (0, 6)},
+        {"name": "s2", "action": "block", "span": (0, 9)},
+    ]
+
+
+def test_priority_decides_overlapping_rules(pattern_file):
+    pattern_file([
+        _rule("generic", r"\d+", action="generalize", replacement="[NUM]"),
+        _rule("phone", r"010-?\d{4}-?\d{4}", replacement="[PHONE]"),
+    ])
+    assert app.apply_patterns("010-1234-5678")[0] == "[PHONE]"
+
+
+def test_unfusable_rules_run_standalone(pattern_file):
+    pattern_file([
+        _rule("repeat", r"(\d)\1{3}", replacement="[REP]"),
+        _rule("flagged", r"(?i)secret", replacement="[S]"),
+        _rule("named_a", r"(?P<x>abc)", replacement="[A]"),
+        _rule("named_b", r"(?P<x>xyz)", replacement="[B]"),
+        _rule("phone", r"010-?\d{4}-?\d{4}", replacement="[P]"),
+    ])
+    masked, findings = app.apply_patterns("SeCrEt 7777 abc xyz 010-1234-5678 1234")
+    assert masked == "[S] [REP] [A] [B] [P] 1234"
+    assert [f["span"] for f in findings] == [(0, 6), (7, 11), (12, 15), (16, 19), (20, 33)]
+
+
+@pytest.mark.parametrize("first", [r"(\d)\1", r"(?:11)"])
+def test_overlapped_hit_is_rescanned(pattern_file, first):
+    # Masking must not depend on whether an unrelated rule runs standalone.
+    pattern_file([_rule("rep", first, replacement="[R]"), _rule("num", r"\d{3,}", replacement="[N]")])
+    masked, findings = app.apply_patterns("1123456")
+    assert masked == "[R][N]"
+    assert [f["span"] for f in findings] == [(0, 2), (2, 7)]
+
+
+def test_conditional_group_rule_runs_standalone(pattern_file):
+    pattern_file([_rule("x", r"x"), _rule("tag", r"(<)?\w+(?(1)>)")])
+    assert app.apply_patterns("<abc> def")[0] == "[X] [X]"
+
+
+def test_invalid_rule_is_rejected_by_name(pattern_file):
+    with pytest.raises(ValueError, match="'broken'"):
+        pattern_file([_rule("ok", r"\d"), _rule("broken", r"(")])
+
+
+def test_zero_width_hits_mask_nothing(pattern_file):
+    pattern_file([_rule("edge", r"\b"), _rule("look", r"(?=b)", action="block")])
+    assert app.apply_patterns("ab") == ("ab", [])
+
+
+@pytest.mark.parametrize("engine", ["re", "re2"])
+def test_engines_agree_on_ascii_digits(pattern_file, monkeypatch, engine):
+    if engine == "re":
+        monkeypatch.setattr(app, "re2", None)
+    elif app.re2 is None:
+        pytest.skip("google-re2 not installed")
+    pattern_file([_rule("digits", r"\d{3}")])
+    assert app.apply_patterns("123 １２３")[0] == "[X] １２３"
+
+
+@pytest.mark.parametrize("engine", ["re", "re2"])
+def test_engines_agree_on_end_anchor_before_newline(pattern_file, monkeypatch, engine):
+    if engine == "re":
+        monkeypatch.setattr(app, "re2", None)
+    elif app.re2 is None:
+        pytest.skip("google-re2 not installed")
+    pattern_file([_rule("tail", r"\d{3}$")])
+    assert app.apply_patterns("abc 123\n")[0] == "abc [X]\n"
+    assert app.apply_patterns("123 abc\n\n")[0] == "123 abc\n\n"
+
+
+def test_re2_rejected_rule_runs_alone_and_is_logged(pattern_file, caplog):
+    if app.re2 is None:
+        pytest.skip("google-re2 not installed")
+    with caplog.at_level(logging.WARNING, logger=app.log.name):
+        ps = pattern_file([
+            _rule("won", r"\d{4}(?=원)"),
+            _rule("redos", r"(a+)+$"),
+            _rule("ci", r"(?i)secret"),
+        ])
+    # Only the lookahead rule falls back; the pathological one stays on RE2.
+    assert not isinstance(ps.current.mask_re, re.Pattern)
+    solo = {p["name"]: rx for _, rx, p in ps.current.mask_solo}
+    assert set(solo) == {"won", "ci"}
+    assert isinstance(solo["won"], re.Pattern)
+    assert not isinstance(solo["ci"], re.Pattern)
+    assert "'won'" in caplog.text and "'ci'" not in caplog.text
+    assert app.apply_patterns("SECRET 1234원 aaa")[0] == "[X] [X]원 [X]"
+
+
+def test_reload_swaps_on_mtime_change(pattern_file):
+    ps = pattern_file([_rule("a", r"aaa")])
+    assert not ps.reload_if_changed()
+    _write(ps.path, {"sensitive_patterns": [_rule("b", r"bbb")]}, 1_000_010)
+    assert ps.reload_if_changed()
+    assert app.apply_patterns("aaa bbb")[0] == "aaa [X]"
+
+
+@pytest.mark.parametrize("body", [
+    '{"sensitive_patterns": [',
+    '{"sensitive_patterns": null}',
+    '{"sensitive_patterns": [1]}',
+    '{"sensitive_patterns": [{"name": "n", "action": "mask"}]}',
+    '{"sensitive_patterns": [{"name": "n", "regex": "(", "action": "mask"}]}',
+    '[]',
+    '{"sensitive_patterns": [{"name": "n", "regex": "x", "action": "allow"}]}',
+    '{"sensitive_patterns": [{"name": "n", "regex": "x", "action": "Block"}]}',
+    '{"sensitive_patterns": [{"name": "n", "regex": "x*", "action": "mask"}]}',
+])
+def test_reload_keeps_last_good_set(pattern_file, body):
+    ps = pattern_file([_rule("a", r"aaa")])
+    before = ps.current
+    _write(ps.path, body, 1_000_010)
+    assert not ps.reload_if_changed()
+    assert ps.current is before
+    assert app.apply_patterns("aaa")[0] == "[X]"
+    # A fixed file is picked up on its next change.
+    _write(ps.path, {"sensitive_patterns": [_rule("b", r"bbb")]}, 1_000_020)
+    assert ps.reload_if_changed()
+
+
+def test_failed_load_is_retried_and_warned_once(pattern_file, caplog):
+    ps = pattern_file([_rule("a", r"aaa")])
+    _write(ps.path, '{"sensitive_patterns": [', 1_000_010)
+    with caplog.at_level(logging.WARNING, logger=app.log.name):
+        assert not ps.reload_if_changed()
+        assert not ps.reload_if_changed()
+    assert len(caplog.records) == 1
+    # The full write lands within the same coarse mtime tick.
+    _write(ps.path, {"sensitive_patterns": [_rule("b", r"bbb")]}, 1_000_010)
+    assert ps.reload_if_changed()
+    assert app.apply_patterns("bbb")[0] == "[X]"
+
+
+def _watchers():
+    return [t for t in threading.enumerate() if t.name == "pattern-watcher" and t.is_alive()]
+
+
+def _wait_for(predicate):
+    for _ in range(500):
+        if predicate():
+            return True
+        threading.Event().wait(0.01)
+    return False
+
+
+def test_watcher_starts_once_and_survives_bad_files(pattern_file):
+    ps = pattern_file([_rule("a", r"aaa")])
+    ps.interval = 0.01
+    assert _watchers() == []
+    ps.start_watching()
+    ps.start_watching()
+    try:
+        assert len(_watchers()) == 1
+        _write(ps.path, '{"sensitive_patterns": null}', 1_000_010)
+        assert _wait_for(lambda: ps._last_error is not None)
+
+        calls = []
+
+        def boom():
+            calls.append(1)
+            raise RuntimeError("unexpected")
+
+        ps._compile_all = boom
+        _write(ps.path, {"sensitive_patterns": []}, 1_000_020)
+        assert _wait_for(lambda: calls)
+        del ps._compile_all
+
+        assert len(_watchers()) == 1
+        _write(ps.path, {"sensitive_patterns": [_rule("b", r"bbb")]}, 1_000_030)
+        assert _wait_for(lambda: ps.stamp[0] == 1_000_030 * 10**9)
+        assert app.apply_patterns("bbb")[0] == "[X]"
+    finally:
+        ps.stop_watching(timeout=1)
+    assert _watchers() == []
+
+
+def test_restart_after_timed_out_stop_leaves_one_watcher(pattern_file):
+    ps = pattern_file([_rule("a", r"aaa")])
+    ps.interval = 0.01
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_reload():
+        entered.set()
+        release.wait(5)
+        return False
+
+    ps.reload_if_changed = slow_reload
+    ps.start_watching()
+    try:
+        assert entered.wait(5)
+        ps.stop_watching(timeout=0.01)  # times out mid-reload
+        del ps.reload_if_changed
+        ps.start_watching()
+        release.set()
+        assert _wait_for(lambda: len(_watchers()) == 1)
+        threading.Event().wait(0.05)
+        assert len(_watchers()) == 1
+    finally:
+        release.set()
+        ps.stop_watching(timeout=1)
+    assert _watchers() == []